@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 import yfinance as yf
 import pandas as pd
@@ -6,84 +7,121 @@ import numpy as np
 # --- PAGE CONFIGURATION ---
 st.set_page_config(page_title="DCF Valuation Model", layout="centered")
 
-# --- 1. DATA GATHERING FUNCTION (Cached for speed) ---
-@st.cache_data
-def get_dcf_inputs(ticker):
+# --- 1. DATA GATHERING FUNCTIONS (Cached for speed) ---
+# The 10Y Treasury yield doesn't depend on the ticker, so it gets its own longer-lived cache
+@st.cache_data(ttl="1h")
+def _fetch_risk_free_rate():
+    return float(yf.Ticker("^TNX").history(period="1d")['Close'].iloc[-1]) / 100
+
+def get_risk_free_rate():
+    # The fallback is applied outside the cache so a failed fetch is retried on the next rerun
+    try:
+        return _fetch_risk_free_rate()
+    # Missing quote data (KeyError/IndexError), bad payloads (ValueError), network failures
+    # (OSError covers both requests' and curl_cffi's RequestException) and yfinance's own errors
+    except (KeyError, IndexError, ValueError, OSError, yf.exceptions.YFException) as e:
+        st.warning(f"Could not fetch the 10Y Treasury yield ({e}); using a 4.0% risk-free rate.")
+        return 0.04
+
+def _ttm_sums(statement, labels):
+    # Sum the last 4 quarters of every label in one NumPy pass
+    # (labels Yahoo didn't report come back as NaN)
+    quarters = statement.reindex(labels).iloc[:, :4].to_numpy(dtype=np.float64, na_value=np.nan)
+    sums = np.nansum(quarters, axis=1)
+    sums[np.isnan(quarters).all(axis=1)] = np.nan
+    # Plain floats: cheaper scalar math downstream and a lean cached payload
+    return sums.tolist()
+
+def _compute_wacc(market_cap, total_debt, implied_interest, ttm_pretax, tax_prov,
+                  beta, risk_free_rate, market_return=0.10):
+    # Cost of Equity (CAPM)
+    cost_of_equity = risk_free_rate + beta * (market_return - risk_free_rate)
+    
+    # Cost of Debt
+    cost_of_debt = (implied_interest / total_debt) if total_debt > 0 else 0.0
+    
+    # Tax Rate
+    if np.isnan(tax_prov) or np.isnan(ttm_pretax) or ttm_pretax == 0:
+        tax_rate = 0.21
+    else:
+        tax_rate = tax_prov / ttm_pretax
+    
+    # WACC Calc
+    total_val = market_cap + total_debt
+    equity_w = market_cap / total_val
+    debt_w = total_debt / total_val
+    return (equity_w * cost_of_equity) + (debt_w * cost_of_debt * (1 - tax_rate))
+
+@st.cache_data(ttl="15m", max_entries=256)
+def get_dcf_inputs(ticker, risk_free_rate):
+    # Fresh Ticker per fetch: yfinance memoizes data on the object, so sharing
+    # one would outlive this cache's TTL
     stock = yf.Ticker(ticker)
     
+    # Quote info and the two statements are separate Yahoo requests, so fetch them in parallel
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        info, q_cashflow, q_financials = ex.map(
+            lambda attr: getattr(stock, attr), ['info', 'quarterly_cash_flow', 'quarterly_financials']
+        )
+    
     # Check if data exists
-    if stock.info.get('marketCap') is None:
+    if info.get('marketCap') is None:
         return None
     
     # Basic info
-    market_cap = stock.info.get('marketCap')
-    shares_outstanding = stock.info.get('sharesOutstanding')
-    current_price = stock.info.get('currentPrice')
+    market_cap = info.get('marketCap')
+    shares_outstanding = info.get('sharesOutstanding')
+    current_price = info.get('currentPrice')
     
-    # Quarterly Financials
-    q_cashflow = stock.quarterly_cash_flow
-    q_financials = stock.quarterly_financials
+    # Some quote summaries omit these; fast_info has them without another .info scrape
+    if shares_outstanding is None or current_price is None:
+        try:
+            fi = stock.fast_info
+            shares_outstanding = shares_outstanding or fi.shares
+            current_price = current_price or fi.last_price
+        except AttributeError:
+            pass
     
     # TTM Calculations
-    ttm_revenue = q_financials.loc['Total Revenue'].iloc[:4].sum()
-    op_cash = q_cashflow.loc['Operating Cash Flow'].iloc[:4].sum()
+    fin_labels = ['Total Revenue', 'EBIT', 'Pretax Income', 'Tax Provision']
+    ttm_revenue, ttm_ebit, ttm_pretax, tax_prov = _ttm_sums(q_financials, fin_labels)
+    
+    cf_labels = ['Operating Cash Flow', 'Capital Expenditure', 'Capex']
+    op_cash, cap_ex, capex_alt = _ttm_sums(q_cashflow, cf_labels)
+    
+    for label, value in (('Total Revenue', ttm_revenue), ('Operating Cash Flow', op_cash)):
+        if np.isnan(value):
+            raise KeyError(label)
     
     # CapEx handling (Yahoo labels vary)
-    if 'Capital Expenditure' in q_cashflow.index:
-        cap_ex = q_cashflow.loc['Capital Expenditure'].iloc[:4].sum()
-    elif 'Capex' in q_cashflow.index:
-        cap_ex = q_cashflow.loc['Capex'].iloc[:4].sum()
-    else:
-        cap_ex = 0
+    if np.isnan(cap_ex):
+        cap_ex = 0 if np.isnan(capex_alt) else capex_alt
             
     ttm_fcf = op_cash + cap_ex 
     
     # WACC Inputs
-    beta = stock.info.get('beta', 1.0)
+    beta = info.get('beta', 1.0)
     
-    # Risk Free Rate
-    try:
-        treasury = yf.Ticker("^TNX") 
-        risk_free_rate = treasury.history(period="1d")['Close'].iloc[-1] / 100
-    except:
-        risk_free_rate = 0.04 
-
-    market_return = 0.10
-    cost_of_equity = risk_free_rate + beta * (market_return - risk_free_rate)
-    
-    # Cost of Debt
-    try:
-        ttm_ebit = q_financials.loc['EBIT'].iloc[:4].sum()
-        ttm_pretax = q_financials.loc['Pretax Income'].iloc[:4].sum()
-        implied_interest = abs(ttm_ebit - ttm_pretax)
-    except KeyError:
+    # Implied interest expense (EBIT - Pretax Income)
+    if np.isnan(ttm_ebit) or np.isnan(ttm_pretax):
         implied_interest = 0.0
+    else:
+        implied_interest = abs(ttm_ebit - ttm_pretax)
 
-    total_debt = stock.info.get('totalDebt', 0)
-    cost_of_debt = (implied_interest / total_debt) if total_debt > 0 else 0.0
+    total_debt = info.get('totalDebt', 0)
     
-    # Tax Rate
-    try:
-        tax_prov = q_financials.loc['Tax Provision'].iloc[:4].sum()
-        tax_rate = tax_prov / ttm_pretax if ttm_pretax != 0 else 0.21
-    except:
-        tax_rate = 0.21
-    
-    # WACC Calc
-    total_val = market_cap + total_debt
-    equity_w = market_cap / total_val
-    debt_w = total_debt / total_val
-    wacc = (equity_w * cost_of_equity) + (debt_w * cost_of_debt * (1 - tax_rate))
+    wacc = _compute_wacc(market_cap, total_debt, implied_interest, ttm_pretax, tax_prov,
+                         beta, risk_free_rate)
     
     return {
-        "Ticker": ticker.upper(),
+        "Ticker": ticker,
         "Current Price": current_price,
         "Shares Outstanding": shares_outstanding,
         "TTM Revenue": ttm_revenue,
         "TTM FCF": ttm_fcf,
         "WACC": wacc,
         "Total Debt": total_debt,
-        "Cash": stock.info.get('totalCash', 0)
+        "Cash": info.get('totalCash', 0)
     }
 
 # --- 2. APP UI LAYOUT ---
@@ -97,42 +135,53 @@ with st.sidebar:
     
     st.divider()
     
-    # --- Growth Rates ---
-    st.subheader("Growth Assumptions")
-    growth_rate_percent = st.slider(
-        "Revenue Growth Rate (Years 1-5)", 
-        min_value=-10.0, max_value=50.0, value=5.0, step=0.5, format="%.1f%%"
-    )
-    growth_rate = growth_rate_percent / 100.0
+    # Assumptions are batched in a form so the app reruns once per "Update",
+    # not on every slider step
+    with st.form("inputs"):
+        # --- Growth Rates ---
+        st.subheader("Growth Assumptions")
+        growth_rate_percent = st.slider(
+            "Revenue Growth Rate (Years 1-5)", 
+            min_value=-10.0, max_value=50.0, value=5.0, step=0.5, format="%.1f%%"
+        )
+        growth_rate = growth_rate_percent / 100.0
     
-    terminal_growth_percent = st.slider(
-        "Terminal Growth Rate (Year 5+)", 
-        min_value=0.1, max_value=5.0, value=2.5, step=0.1, format="%.1f%%"
-    )
-    terminal_growth_rate = terminal_growth_percent / 100.0
+        terminal_growth_percent = st.slider(
+            "Terminal Growth Rate (Year 5+)", 
+            min_value=0.1, max_value=5.0, value=2.5, step=0.1, format="%.1f%%"
+        )
+        terminal_growth_rate = terminal_growth_percent / 100.0
 
-    st.divider()
+        st.divider()
 
-    # --- FCF Margin Override ---
-    st.subheader("Margin Assumptions")
-    use_manual_margin = st.checkbox("Override Historical FCF Margin?")
+        # --- FCF Margin Override ---
+        st.subheader("Margin Assumptions")
+        use_manual_margin = st.checkbox("Override Historical FCF Margin?")
     
-    if use_manual_margin:
+        # Form widgets don't rerun until submit, so the slider is always shown
+        # and only used when the override is checked
         manual_margin_percent = st.slider(
             "Projected FCF Margin", 
             min_value=-10.0, max_value=50.0, value=20.0, step=0.5, format="%.1f%%"
         )
-        projected_margin = manual_margin_percent / 100.0
-    else:
-        projected_margin = None # Will be calculated from data
+        if use_manual_margin:
+            projected_margin = manual_margin_percent / 100.0
+        else:
+            projected_margin = None # Will be calculated from data
+
+        st.form_submit_button("Update")
 
     st.info("Note: Terminal Growth must be lower than WACC.")
 
 # --- 3. MAIN LOGIC ---
-if ticker_input:
-    with st.spinner(f"Fetching data for {ticker_input}..."):
+# Normalize so "aapl" and " AAPL " share one cache entry
+ticker_key = ticker_input.strip().upper()
+
+if ticker_key:
+    with st.spinner(f"Fetching data for {ticker_key}..."):
         try:
-            data = get_dcf_inputs(ticker_input)
+            risk_free_rate = get_risk_free_rate()
+            data = get_dcf_inputs(ticker_key, risk_free_rate)
             
             if data is None:
                 st.error("Could not fetch data. Please check the ticker.")
@@ -163,47 +212,40 @@ if ticker_input:
                 col3.metric(f"FCF Margin ({margin_label})", f"{final_margin_used:.1%}")
 
                 # Projections
-                future_fcf = []
-                discount_factors = []
-                discounted_fcf = []
-                years = range(1, 6)
-                
-                projection_data = []
-
-                current_rev = revenue
-                for year in years:
-                    current_rev = current_rev * (1 + growth_rate)
-                    estimated_fcf = current_rev * final_margin_used
-                    disc_factor = 1 / ((1 + wacc) ** year)
-                    pv_fcf = estimated_fcf * disc_factor
-                    
-                    future_fcf.append(estimated_fcf)
-                    discount_factors.append(disc_factor)
-                    discounted_fcf.append(pv_fcf)
-                    
-                    projection_data.append({
-                        "Year": year,
-                        "Revenue ($B)": current_rev/1e9,
-                        "FCF ($B)": estimated_fcf/1e9,
-                        "PV of FCF ($B)": pv_fcf/1e9
-                    })
+                years = np.arange(1, 6)
+                # Running products of the yearly factors (no pow calls needed)
+                growth_factors = np.cumprod(np.full(len(years), 1 + growth_rate))
+                rev_arr = revenue * growth_factors
+                fcf_arr = rev_arr * final_margin_used
+                disc_arr = np.cumprod(np.full(len(years), 1 / (1 + wacc)))
+                pv_arr = fcf_arr * disc_arr
 
                 # Display Projection Table
                 st.subheader("5-Year Projections")
-                df_proj = pd.DataFrame(projection_data)
-                st.dataframe(df_proj.style.format("{:.2f}"))
+                df_proj = pd.DataFrame({
+                    "Year": years,
+                    "Revenue ($B)": rev_arr/1e9,
+                    "FCF ($B)": fcf_arr/1e9,
+                    "PV of FCF ($B)": pv_arr/1e9
+                }).round(2)
+                st.dataframe(df_proj, column_config={
+                    "Year": st.column_config.NumberColumn(format="%d"),
+                    "Revenue ($B)": st.column_config.NumberColumn(format="%.2f"),
+                    "FCF ($B)": st.column_config.NumberColumn(format="%.2f"),
+                    "PV of FCF ($B)": st.column_config.NumberColumn(format="%.2f")
+                })
 
                 # Terminal Value
-                fcf_year_5 = future_fcf[-1]
+                fcf_year_5 = fcf_arr[-1]
                 if wacc <= terminal_growth_rate:
                     st.error("Error: WACC must be higher than Terminal Growth Rate.")
                     st.stop()
                     
                 terminal_value = (fcf_year_5 * (1 + terminal_growth_rate)) / (wacc - terminal_growth_rate)
-                pv_terminal_value = terminal_value * discount_factors[-1]
+                pv_terminal_value = terminal_value * disc_arr[-1]
 
                 # Final Value Steps
-                sum_pv_fcf = sum(discounted_fcf)
+                sum_pv_fcf = pv_arr.sum()
                 enterprise_value = sum_pv_fcf + pv_terminal_value
                 equity_value = enterprise_value + cash - debt
                 calculated_share_price = equity_value / shares